@@ -1,11 +1,15 @@
 #!/usr/bin/env python3.9
 # coding=utf-8
+import argparse
 from pathlib import Path
 
 import pandas as pd
 import seaborn as sns
 from matplotlib import pyplot as plt
 
+from cache import BuildCache
+from server import QueryClient
+
 # Columns to be converted into categories
 _category_cols = ["k", "p", "q", "t", "l", "i", "h"]
 
@@ -229,8 +233,23 @@ def plot_conditions(df: pd.DataFrame, fig_location: str = None,
 
 
 if __name__ == "__main__":
-    accidents_df = get_dataframe("accidents.pkl.gz", verbose=True)
-    plot_roadtype(accidents_df, fig_location="01_roadtype.png",
-                  show_figure=True)
-    plot_animals(accidents_df, "02_animals.png", True)
-    plot_conditions(accidents_df, "03_conditions.png", True)
+    parser = argparse.ArgumentParser(description="Plot accident statistics")
+    parser.add_argument('--server', default=None,
+                        help='URL of a running query server, loads the data locally if not given')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild the outputs even if they are up to date')
+    args = parser.parse_args()
+
+    if args.server:
+        accidents_df = QueryClient(args.server).select(["p1", "p10", "p18", "p21", "region", "date"])
+    else:
+        accidents_df = get_dataframe("accidents.pkl.gz", verbose=True)
+
+    # rebuild only the figures whose data slice or code changed
+    cache = BuildCache(force=args.force)
+    cache.build(plot_roadtype, accidents_df, "01_roadtype.png",
+                columns=["p1", "p21", "region"], show_figure=True)
+    cache.build(plot_animals, accidents_df, "02_animals.png",
+                columns=["p1", "p10", "region", "date"], show_figure=True)
+    cache.build(plot_conditions, accidents_df, "03_conditions.png",
+                columns=["p1", "p18", "region", "date"], show_figure=True)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from download import DataDownloader
+from server import filter_mask
+
+
+class Estimate(NamedTuple):
+    value: float
+    low: float
+    high: float
+    exact: bool
+    rate: float = None
+
+
+def _stratified_total(y: np.ndarray, strata: np.ndarray, n_strata: int, sizes: np.ndarray,
+                      sampled: np.ndarray):
+    """
+    Estimate the population total of y from a stratified sample without replacement
+    :param y: value of each sampled row
+    :param strata: stratum index of each sampled row
+    :param n_strata: number of strata
+    :param sizes: stratum size of each stratum
+    :param sampled: number of sampled rows of each stratum
+    :return: tuple (total, variance)
+    """
+    s1 = np.bincount(strata, y, n_strata)
+    s2 = np.bincount(strata, y * y, n_strata)
+    mean = s1 / sampled
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var_h = np.where(sampled > 1, (s2 - sampled * mean ** 2) / (sampled - 1), 0)
+
+    total = np.sum(sizes * mean)
+    variance = np.sum(sizes ** 2 * (1 - sampled / sizes) * np.maximum(var_h, 0) / sampled)
+
+    return total, variance
+
+
+class ApproxEngine:
+    """
+    Answers count and proportion queries from stratified samples with confidence bounds
+    The samples are maintained by DataDownloader.get_sample, the lowest rate meeting the
+    requested precision is used and the full dataset is evaluated if none of them does
+
+    Attributes:
+        min_hits    minimum number of matching sampled rows for a sample estimate to be trusted
+    """
+
+    min_hits = 10
+
+    def __init__(self, downloader: DataDownloader = None, regions=None):
+        """
+        Initializes the ApproxEngine
+        :param downloader: DataDownloader providing the samples and the full data
+        :param regions: List of regions or None for every region
+        """
+        self._dd = downloader or DataDownloader()
+        self._regions = regions
+        self._samples = {}
+        self._full = None
+
+    def _sample(self, rate):
+        """
+        Load the sample for the given rate together with its strata
+        :param rate: sampling rate
+        :return: tuple (dataframe, strata, n_strata, sizes, sampled)
+        """
+        if rate not in self._samples:
+            df = pd.DataFrame(self._dd.get_sample(self._regions, rate))
+            strata = df.groupby(["region", df["p2a"].dt.year]).ngroup().values
+            n_strata = strata.max() + 1
+
+            sizes, sampled = np.zeros(n_strata), np.zeros(n_strata)
+            sizes[strata] = df["_N"].values
+            sampled[strata] = df["_n"].values
+
+            self._samples[rate] = (df, strata, n_strata, sizes, sampled)
+
+        return self._samples[rate]
+
+    def _exact(self) -> pd.DataFrame:
+        """
+        Load the full dataset
+        :return: dataframe with every record
+        """
+        if self._full is None:
+            self._full = pd.DataFrame(self._dd.get_dict(self._regions))
+
+        return self._full
+
+    def count(self, filters: dict = None, max_error: float = None, confidence: float = 0.95) -> Estimate:
+        """
+        Estimate the number of records matching the filters
+        :param filters: query filters as accepted by server.filter_mask
+        :param max_error: maximum half-width of the interval relative to the estimate,
+                          None accepts any rate with at least min_hits matching rows
+        :param confidence: confidence level of the interval
+        :return: Estimate(value, low, high, exact, rate)
+        """
+        z = norm.ppf((1 + confidence) / 2)
+
+        for rate in sorted(self._dd.sample_rates):
+            df, strata, n_strata, sizes, sampled = self._sample(rate)
+            y = filter_mask(df, filters).astype(float)
+
+            # too few matching rows make the variance estimate (and a zero estimate) meaningless
+            if np.count_nonzero(y) < self.min_hits:
+                continue
+
+            total, variance = _stratified_total(y, strata, n_strata, sizes, sampled)
+            error = z * np.sqrt(variance)
+
+            if max_error is None or error <= max_error * total:
+                return Estimate(total, max(total - error, 0), total + error, False, rate)
+
+        value = np.count_nonzero(filter_mask(self._exact(), filters))
+        return Estimate(value, value, value, True)
+
+    def proportion(self, filters: dict, within: dict = None, max_error: float = None,
+                   confidence: float = 0.95) -> Estimate:
+        """
+        Estimate the share of records matching the filters among the records matching within
+        :param filters: query filters of the numerator as accepted by server.filter_mask
+        :param within: query filters of the denominator, None for every record
+        :param max_error: maximum absolute half-width of the interval,
+                          None accepts any rate with at least min_hits matching and min_hits non-matching rows
+        :param confidence: confidence level of the interval
+        :return: Estimate(value, low, high, exact, rate) with the share in the range [0, 1]
+        """
+        z = norm.ppf((1 + confidence) / 2)
+
+        for rate in sorted(self._dd.sample_rates):
+            df, strata, n_strata, sizes, sampled = self._sample(rate)
+            x = filter_mask(df, within).astype(float)
+            y = x * filter_mask(df, filters)
+
+            total_x, _ = _stratified_total(x, strata, n_strata, sizes, sampled)
+            total_y, _ = _stratified_total(y, strata, n_strata, sizes, sampled)
+
+            # shares close to 0 or 1 need enough rows on both sides for a meaningful interval
+            hits = np.count_nonzero(y)
+            if min(hits, np.count_nonzero(x) - hits) < self.min_hits:
+                continue
+
+            # linearized variance of the ratio estimator
+            ratio = total_y / total_x
+            _, variance = _stratified_total(y - ratio * x, strata, n_strata, sizes, sampled)
+            error = z * np.sqrt(variance) / total_x
+
+            if max_error is None or error <= max_error:
+                return Estimate(ratio, max(ratio - error, 0), min(ratio + error, 1), False, rate)
+
+        df = self._exact()
+        x = filter_mask(df, within)
+        value = np.count_nonzero(x & filter_mask(df, filters)) / max(np.count_nonzero(x), 1)
+        return Estimate(value, value, value, True)
+
+
+if __name__ == "__main__":
+    engine = ApproxEngine()
+    print("Fatal accidents:", engine.count({"p13a": {"gt": 0}}))
+    print("Fatal accidents in JHM:", engine.count({"p13a": {"gt": 0}, "region": "JHM"}, max_error=0.05))
+    print("Share of accidents in rain:", engine.proportion({"p18": 3}, {"p18": {"gt": 0}}, max_error=0.005))
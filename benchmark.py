@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from download import DataDownloader
+
+
+class _SyntheticDownloader(DataDownloader):
+    """
+    DataDownloader with generated region data, so the benchmark runs without network access
+
+    Attributes:
+        parses      number of parse_region_data calls, equals the number of regions if loads are shared
+    """
+
+    _cache_mem = {}
+    _cache_lru = OrderedDict()
+    _cache_nbytes = {}
+    _cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+    _cache_sample = {}
+    _region_locks = {}
+    _lock = threading.Lock()
+
+    parses = 0
+
+    def __init__(self, folder, rows=20000):
+        super().__init__(folder=folder)
+        self._rows = rows
+
+    def parse_region_data(self, region):
+        with self._lock:
+            _SyntheticDownloader.parses += 1
+
+        rng = np.random.default_rng(int(self.regions[region]))
+        days = rng.integers(0, 6 * 365, self._rows)
+        return {
+            "p1": np.arange(self._rows).astype("U"),
+            "p2a": np.datetime64("2016-01-01") + days,
+            "p13a": rng.integers(0, 2, self._rows),
+            "p18": rng.integers(0, 8, self._rows),
+            "region": np.full(self._rows, region),
+        }
+
+    @classmethod
+    def reset(cls):
+        cls.clear_cache()
+        cls._region_locks.clear()
+        cls.parses = 0
+
+
+def bench_get_dict(make_downloader, threads: int, calls: int, seed: int = 0) -> float:
+    """
+    Call get_dict from many threads at once, each call requests a random region
+    :param make_downloader: callable returning the DataDownloader used by every thread
+    :param threads: number of concurrent callers
+    :param calls: total number of get_dict calls
+    :param seed: seed of the requested regions
+    :return: elapsed time in seconds
+    """
+    dd = make_downloader()
+    regions = np.random.default_rng(seed).choice(list(dd.regions.keys()), calls)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(lambda region: dd.get_dict([region]), regions))
+
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark concurrent DataDownloader.get_dict calls")
+    parser.add_argument('--real', action='store_true',
+                        help='Use the real DataDownloader and its data folder instead of generated data')
+    parser.add_argument('--calls', type=int, default=2000,
+                        help='Total number of get_dict calls')
+    parser.add_argument('--threads', type=int, nargs="+", default=[1, 4, 16, 64],
+                        help='Numbers of concurrent callers')
+    parser.add_argument('--budget', type=int, default=None,
+                        help='Byte budget of the in-memory region cache')
+
+    args = parser.parse_args()
+    DataDownloader.cache_budget = args.budget
+
+    for n_threads in args.threads:
+        if args.real:
+            DataDownloader.clear_cache()
+            elapsed = bench_get_dict(DataDownloader, n_threads, args.calls)
+            print(f"threads={n_threads:3d} {args.calls / elapsed:10.1f} calls/s "
+                  f"evictions={DataDownloader._cache_stats['evictions']}")
+            continue
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            _SyntheticDownloader.reset()
+            elapsed = bench_get_dict(lambda: _SyntheticDownloader(tmp_dir), n_threads, args.calls)
+            print(f"threads={n_threads:3d} {args.calls / elapsed:10.1f} calls/s "
+                  f"parses={_SyntheticDownloader.parses} "
+                  f"evictions={_SyntheticDownloader._cache_stats['evictions']}")
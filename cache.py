@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import hashlib
+import inspect
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def _hash_data(data, columns=None) -> str:
+    """
+    Hash the given data slice
+    :param data: DataFrame or dict({(header: str): (values: np.array)}) as returned from DataDownloader.get_dict
+    :param columns: list of columns which make up the slice, if None every column is hashed
+    :return: hex digest of the slice
+    """
+    h = hashlib.sha256()
+    columns = sorted(data.keys()) if columns is None else columns
+
+    for col in columns:
+        # object columns are hashed by value, not by the bytes of their pointers
+        values = pd.Series(np.asarray(data[col]))
+        h.update(str(col).encode())
+        h.update(str(values.dtype).encode())
+        h.update(pd.util.hash_pandas_object(values, index=False).values.tobytes())
+
+    return h.hexdigest()
+
+
+def _hash_code(funcs) -> str:
+    """
+    Hash the source code of the modules defining the given functions so that the key changes together
+    with the code version, including module-level constants and helpers the functions use
+    :param funcs: iterable of functions
+    :return: hex digest of the source code
+    """
+    h = hashlib.sha256()
+    modules = {inspect.getmodule(func) for func in funcs}
+    for module in sorted(modules, key=lambda m: m.__name__):
+        h.update(module.__name__.encode())
+        h.update(inspect.getsource(module).encode())
+
+    for func in funcs:
+        h.update(func.__qualname__.encode())
+
+    return h.hexdigest()
+
+
+# Parameters which only affect displaying the output, they are not part of the key
+_display_params = ("show_figure",)
+
+
+class BuildCache:
+    """
+    Content-addressed cache for generated figures and tables
+
+    Every output file is recorded in a JSON manifest together with a key derived from
+    the input data slice, the parameters and the source code of the generating function.
+    An output is rebuilt only if the file is missing or its key changed.
+
+    Attributes:
+        built       list of outputs (re)built by this instance
+        skipped     list of outputs which were up to date
+    """
+
+    def __init__(self, manifest=".build_cache.json", force=False):
+        """
+        Initializes the BuildCache
+        :param manifest: path of the JSON manifest mapping output paths to their keys
+        :param force: rebuild every output regardless of the stored keys
+        """
+        self._manifest = manifest
+        self._force = force
+        self._keys = {}
+        self.built = []
+        self.skipped = []
+
+        if Path(manifest).exists():
+            with open(manifest, "r") as f:
+                self._keys = json.load(f)
+
+    def _save_manifest(self):
+        """
+        Atomically save the manifest
+        :return: None
+        """
+        Path(self._manifest).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{self._manifest}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._keys, f, indent=2, sort_keys=True)
+        os.replace(tmp, self._manifest)
+
+    @staticmethod
+    def key(func, data, columns=None, depends=(), **params) -> str:
+        """
+        Compute the key of an output
+        :param func: function generating the output
+        :param data: input data of func
+        :param columns: columns of data used by func, if None every column is considered
+        :param depends: functions from other modules called by func whose code changes should invalidate the output
+        :param params: additional keyword parameters passed to func, display-only parameters are ignored
+        :return: hex digest identifying the output
+        """
+        params = {name: value for name, value in params.items() if name not in _display_params}
+
+        h = hashlib.sha256()
+        h.update(_hash_data(data, columns).encode())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        h.update(_hash_code((func, *depends)).encode())
+        return h.hexdigest()
+
+    def is_fresh(self, output, key) -> bool:
+        """
+        Check whether the output exists and was built with the given key
+        :param output: output file name
+        :param key: key as returned from BuildCache.key
+        :return: True if the output does not have to be rebuilt
+        """
+        return not self._force and Path(output).exists() and self._keys.get(str(output)) == key
+
+    def build(self, func, data, output, columns=None, depends=(), **params) -> bool:
+        """
+        Call func(data, fig_location=output, **params) unless the output is up to date
+        If the output is up to date but a display parameter (e.g. show_figure) is set,
+        func is called without fig_location so the output is shown but not written again
+        :param func: plotting function accepting the fig_location parameter
+        :param data: input data of func
+        :param output: output file name
+        :param columns: columns of data used by func, if None every column is considered
+        :param depends: functions from other modules called by func whose code changes should invalidate the output
+        :param params: additional keyword parameters passed to func
+        :return: True if the output was rebuilt, False if it was skipped
+        """
+        key = self.key(func, data, columns, depends, **params)
+        if self.is_fresh(output, key):
+            if any(params.get(name) for name in _display_params):
+                func(data, fig_location=None, **params)
+
+            self.skipped.append(output)
+            return False
+
+        func(data, fig_location=output, **params)
+
+        self._keys[str(output)] = key
+        self._save_manifest()
+        self.built.append(output)
+        return True
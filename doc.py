@@ -1,3 +1,4 @@
+import argparse
 import re
 import sys
 from pathlib import Path
@@ -7,6 +8,10 @@ import pandas as pd
 import seaborn as sns
 from matplotlib import pyplot as plt, gridspec, colors
 
+from cache import BuildCache
+from resample import bootstrap_count, bootstrap_proportion
+from server import QueryClient
+
 weather_labels = ["Ideal", "Fog", "Light rain", "Rain",
                   "Snow", "Frost", "Strong wind"]
 
@@ -72,8 +77,6 @@ def plot_fig(df: pd.DataFrame,
                     labels=["Worsened", "Ideal"], colormap=pie1_cmap, explode=(0, 0.1))
     ax1.set_title("Weather conditions at accidents overall")
     ax1.set_ylabel("")
-    w_perc = (total_diff[1] / total_diff.sum()) * 100
-    print(f"total percentage of worsened conditions during accidents: {w_perc:.2f}%")
 
     # right pie chart - worsened conditions by type
     worsened = groups.iloc[1:]
@@ -100,14 +103,6 @@ def plot_fig(df: pd.DataFrame,
     s.set_ylabel("Accidents")
     s.get_legend().set(title="Weather condition")
 
-    w_total_stc = data[data["region"] == "STC"]["p1"].sum()
-    print(f"Total accidents caused while worsened conditions in STC region: {w_total_stc}")
-
-    pha = data[data["region"] == "PHA"].set_index("weather")
-    w_rain_perc_pha = (pha.loc["Rain", "p1"] / pha["p1"].sum()) * 100
-    print(f"Percentage of acidents caused while raining "
-          f"compared to all worsened conditions in PHA: {w_rain_perc_pha:.2f}%")
-
     if fig_location:
         Path(fig_location).parent.mkdir(parents=True, exist_ok=True)
         plt.savefig(fig_location)
@@ -116,6 +111,50 @@ def plot_fig(df: pd.DataFrame,
         plt.show()
 
 
+def print_stats(df: pd.DataFrame,
+                stream: TextIO = sys.stdout):
+    """
+    Print the numbers referenced in the report together with their 95% bootstrap confidence intervals
+    :param df: dataframe to examine
+    :param stream: stream to write the numbers
+    :return: None
+    """
+    # p18 codes start at 1 for ideal conditions, the codes follow weather_labels
+    rain = weather_labels.index("Rain") + 1
+
+    # filter out "other" weather conditions
+    df = df[df["p18"] > 0]
+    weather_counts = df.groupby("p18")["p1"].count()
+    w_perc = bootstrap_proportion(weather_counts.values, weather_counts.index > 1, seed=0)
+    print(f"total percentage of worsened conditions during accidents: {w_perc.value * 100:.2f}% "
+          f"(95% CI {w_perc.low * 100:.2f}-{w_perc.high * 100:.2f}%)", file=stream)
+
+    # worsened conditions only
+    df = df[df["p18"] > 1]
+    region_totals = df.groupby("region")["p1"].count()
+    w_total_stc = bootstrap_count(region_totals.values, region_totals.index == "STC", seed=0)
+    print(f"Total accidents caused while worsened conditions in STC region: {w_total_stc.value:.0f} "
+          f"(95% CI {w_total_stc.low:.0f}-{w_total_stc.high:.0f})", file=stream)
+
+    pha = df[df["region"] == "PHA"].groupby("p18")["p1"].count()
+    w_rain_perc_pha = bootstrap_proportion(pha.values, pha.index == rain, seed=0)
+    print(f"Percentage of acidents caused while raining "
+          f"compared to all worsened conditions in PHA: {w_rain_perc_pha.value * 100:.2f}% "
+          f"(95% CI {w_rain_perc_pha.low * 100:.2f}-{w_rain_perc_pha.high * 100:.2f}%)", file=stream)
+
+
+def save_stats(df: pd.DataFrame, fig_location: str):
+    """
+    Compute the report numbers and save them to the given file
+    :param df: dataframe to examine
+    :param fig_location: file name where the numbers should be saved
+    :return: None
+    """
+    Path(fig_location).parent.mkdir(parents=True, exist_ok=True)
+    with open(fig_location, "w") as f:
+        print_stats(df, f)
+
+
 def create_table(df: pd.DataFrame) -> pd.DataFrame:
     """
     Format the table so that it represents something useful
@@ -160,12 +199,45 @@ def table_to_tex(df: pd.DataFrame,
     tex = re.sub(r"^{}", r"\\textbf{Weather}", tex, flags=re.MULTILINE)
 
     # Print the latex table
-    print("%%%%%%%% INSERT TABLE %%%%%%%%")
+    print("%%%%%%%% INSERT TABLE %%%%%%%%", file=stream)
     print(tex, file=stream, end="")
-    print("%%%%%%%% INSERT TABLE %%%%%%%%")
+    print("%%%%%%%% INSERT TABLE %%%%%%%%", file=stream)
+
+
+def save_table(df: pd.DataFrame, fig_location: str):
+    """
+    Create the table and save it in latex format to the given file
+    :param df: dataframe to examine
+    :param fig_location: file name where the table should be saved
+    :return: None
+    """
+    Path(fig_location).parent.mkdir(parents=True, exist_ok=True)
+    with open(fig_location, "w") as f:
+        table_to_tex(create_table(df), f)
 
 
 if __name__ == '__main__':
-    df_v = get_dataframe("accidents.pkl.gz")
-    plot_fig(df_v, fig_location="fig.pdf", show_figure=False)
-    table_to_tex(create_table(df_v))
+    parser = argparse.ArgumentParser(description="Generate the report figure and table")
+    parser.add_argument('--server', default=None,
+                        help='URL of a running query server, loads the data locally if not given')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild the outputs even if they are up to date')
+    args = parser.parse_args()
+
+    if args.server:
+        df_v = QueryClient(args.server).select(["p1", "p18", "region", "date"])
+    else:
+        df_v = get_dataframe("accidents.pkl.gz")
+
+    # rebuild only the outputs whose data slice or code changed
+    cache = BuildCache(force=args.force)
+    cache.build(plot_fig, df_v, "fig.pdf",
+                columns=["p1", "p18", "region"], show_figure=False)
+    cache.build(save_stats, df_v, "stats.txt",
+                columns=["p1", "p18", "region"], depends=(bootstrap_count, bootstrap_proportion))
+    cache.build(save_table, df_v, "table.tex",
+                columns=["p1", "p18", "date"])
+
+    # print the report numbers and the table even if they were not rebuilt
+    for output in ["stats.txt", "table.tex"]:
+        print(Path(output).read_text(), end="")
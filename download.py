@@ -7,8 +7,11 @@ import os.path
 import pickle
 import re
 import sys
+import tempfile
+import threading
 import urllib.parse
 import zipfile
+from collections import OrderedDict
 from pathlib import Path
 
 import numpy as np
@@ -22,6 +25,9 @@ class DataDownloader:
         headers     CSV column headers
         types       CSV column types
         regions     Dictionary map from region code to CSV file name
+        sample_rates    Sampling rates of the stratified samples maintained together with the region cache
+        sample_max_stratum  Maximum number of sampled rows of one stratum (region and year)
+        cache_budget    Byte budget of the in-memory region and sample cache, None for unlimited
     """
 
     # 64 total, 8 in each row
@@ -71,22 +77,52 @@ class DataDownloader:
     # regex for valid end of year files
     _re_file_eoy = re.compile(r"data-?gis-?((rok)?-?(\d\d\d\d)|08-2021).*")
 
-    # List of ZIP files - cached so we don't have to request self._url each time
+    # List of ZIP files - cached so we don't have to request self._url each time, shared by every instance
     _file_list = None
 
     # Memory cache for processed region data
     _cache_mem = {}
 
-    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data", cache_filename="data_{}.pkl.gz"):
+    # Recency order of the memory cache entries from the least recently used one,
+    # region codes refer to _cache_mem and (region, rate) tuples to _cache_sample
+    _cache_lru = OrderedDict()
+
+    # Size of each entry of _cache_lru in bytes
+    _cache_nbytes = {}
+
+    # Counters of the memory cache, see cache_info
+    _cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+    cache_budget = None
+
+    sample_rates = (0.01, 0.1)
+    sample_max_stratum = 1000
+
+    # Memory cache for stratified samples, keyed by (region, rate)
+    _cache_sample = {}
+
+    # Guards the memory caches and _region_locks, shared by every instance like the caches
+    _lock = threading.Lock()
+
+    # Per-region locks, the first thread loads a cold region while the other threads wait for its result
+    _region_locks = {}
+
+    # Serializes downloading of the ZIP file list and the ZIP files
+    _download_lock = threading.Lock()
+
+    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data", cache_filename="data_{}.pkl.gz",
+                 sample_filename="sample_{}_{}.pkl.gz"):
         """
         Initializes the DataDownloader
         :param url: download URL containing the index of ZIP data files
         :param folder: cache folder, contains the downloaded source ZIP files and processed cache
         :param cache_filename: filename format string for storing cache files
+        :param sample_filename: filename format string for storing sample cache files (region, rate)
         """
         self._url = url
         self._folder = folder
         self._cache_filename = os.path.join(folder, cache_filename)
+        self._sample_filename = os.path.join(folder, sample_filename)
         self.type_map = dict(zip(self.headers, self.types))
 
     def _download_file_list(self):
@@ -101,9 +137,10 @@ class DataDownloader:
 
             url = urllib.parse.urljoin(self._url, file_location)
             with requests.get(url, stream=True) as r:
-                with open(dest, "wb") as f:
+                with open(dest + ".part", "wb") as f:
                     for chunk in r:
                         f.write(chunk)
+            os.replace(dest + ".part", dest)
 
     def download_data(self):
         """
@@ -112,21 +149,22 @@ class DataDownloader:
         """
         Path(self._folder).mkdir(parents=True, exist_ok=True)
 
-        # Download the file list only once
-        if self._file_list is not None:
-            self._download_file_list()
-            return
+        with self._download_lock:
+            # Download the file list only once
+            if self._file_list is not None:
+                self._download_file_list()
+                return
 
-        resp = requests.get(self._url)
-        if resp.status_code != 200:
-            print(f"Error: repsonse code {resp.status_code}", file=sys.stderr)
-            return
+            resp = requests.get(self._url)
+            if resp.status_code != 200:
+                print(f"Error: repsonse code {resp.status_code}", file=sys.stderr)
+                return
 
-        soup = BeautifulSoup(resp.text, features="html.parser")
-        self._file_list = [button["onclick"].split("'")[1] for button in soup.findAll("button")]
-        self._file_list = [filename for filename in self._file_list if self._re_file_eoy.search(filename)]
+            soup = BeautifulSoup(resp.text, features="html.parser")
+            file_list = [button["onclick"].split("'")[1] for button in soup.findAll("button")]
+            type(self)._file_list = [filename for filename in file_list if self._re_file_eoy.search(filename)]
 
-        self._download_file_list()
+            self._download_file_list()
 
     def parse_region_data(self, region):
         """
@@ -183,33 +221,273 @@ class DataDownloader:
 
         return dict2 if not dict1 else {key: np.append(dict1[key], nparr) for key, nparr in dict2.items()}
 
-    def _save_cache(self, region):
+    @staticmethod
+    def _dump_atomic(obj, filename):
+        """
+        Save obj as a gzip compressed pickle dump
+        The dump is written to a temporary file first, so readers never see a partially written file
+        :param obj: object to save
+        :param filename: destination file name
+        :return: None
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file_tmp, gzip.open(file_tmp, "wb", compresslevel=3) as file_gz:
+                pickle.dump(obj, file_gz)
+            os.replace(tmp, filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _save_cache(self, region, data):
         """
         Save processed data for the given region as a gzip compressed pickle dump
         :param region: region to save
+        :param data: processed region data
         :return: None
         """
-        with gzip.open(self._cache_filename.format(region), "wb", compresslevel=3) as file_gz:
-            pickle.dump(self._cache_mem[region], file_gz)
+        self._dump_atomic(data, self._cache_filename.format(region))
 
     def _load_cache(self, region):
         """
         Load processed data for the given region from a gzip compressed pickle dump
-        :param region: region to save
-        :return: True if the cached region file exists and was successfully loaded, False otherwise
+        :param region: region to load
+        :return: the region data if the cached region file exists, None otherwise
         """
         if not Path(self._cache_filename.format(region)).exists():
-            return False
+            return None
 
         with gzip.open(self._cache_filename.format(region), "rb") as file_gz:
-            self._cache_mem[region] = pickle.load(file_gz)
+            return pickle.load(file_gz)
+
+    def _region_lock(self, region):
+        """
+        Return the lock serializing loads of the given region
+        :param region: region code
+        :return: threading.RLock
+        """
+        with self._lock:
+            return self._region_locks.setdefault(region, threading.RLock())
+
+    def _get_region(self, region):
+        """
+        Return the processed data of the region from memory, a cache file or parse_region_data
+        Concurrent callers of a cold region share a single load, the cache files are written only once
+        :param region: region code
+        :return: dict({(header: str): (values: np.array)})
+        """
+        with self._lock:
+            data = self._cache_hit(region)
+            if data is not None:
+                return data
+
+        with self._region_lock(region):
+            # another thread may have finished loading while we were waiting
+            with self._lock:
+                data = self._cache_hit(region)
+                if data is not None:
+                    return data
+                self._cache_stats["misses"] += 1
+
+            data = self._load_cache(region)
+            if data is None:
+                data = self.parse_region_data(region)
+                self._save_cache(region, data)
+                self._save_samples(region, data)
+
+            with self._lock:
+                self._cache_insert(region, data)
+
+            return data
+
+    def _cache_of(self, key):
+        """
+        Return the memory cache holding the given key
+        :param key: region code or (region, rate) tuple of a sample
+        :return: _cache_mem or _cache_sample
+        """
+        return self._cache_sample if isinstance(key, tuple) else self._cache_mem
+
+    def _cache_hit(self, key):
+        """
+        Look up a region or sample in the memory cache and mark it as the most recently used,
+        the caller holds _lock
+        :param key: region code or (region, rate) tuple of a sample
+        :return: the cached data or None if it is not cached
+        """
+        data = self._cache_of(key).get(key)
+        if data is not None:
+            self._cache_lru.move_to_end(key)
+            self._cache_stats["hits"] += 1
+
+        return data
+
+    def _cache_insert(self, key, data):
+        """
+        Insert a region or sample into the memory cache and evict the least recently used entries exceeding
+        cache_budget, evicted entries are loaded from their cache files on the next request, the caller holds _lock
+        :param key: region code or (region, rate) tuple of a sample
+        :param data: processed region data or sample
+        :return: None
+        """
+        self._cache_stats["bytes"] -= self._cache_nbytes.get(key, 0)
+        self._cache_of(key)[key] = data
+        self._cache_lru[key] = None
+        self._cache_lru.move_to_end(key)
+        self._cache_nbytes[key] = sum(values.nbytes for values in data.values())
+        self._cache_stats["bytes"] += self._cache_nbytes[key]
+
+        # the entry just inserted is kept even if it does not fit into the budget alone
+        while self.cache_budget is not None and self._cache_stats["bytes"] > self.cache_budget \
+                and len(self._cache_lru) > 1:
+            evicted, _ = self._cache_lru.popitem(last=False)
+            del self._cache_of(evicted)[evicted]
+            self._cache_stats["bytes"] -= self._cache_nbytes.pop(evicted)
+            self._cache_stats["evictions"] += 1
+
+    def cache_info(self):
+        """
+        Returns the state of the in-memory region and sample cache
+        :return: dict with the hits, misses, evictions, bytes, budget, cached regions and cached samples
+        """
+        with self._lock:
+            return {**self._cache_stats, "budget": self.cache_budget, "regions": list(self._cache_mem.keys()),
+                    "samples": list(self._cache_sample.keys())}
 
-        return True
+    @classmethod
+    def clear_cache(cls):
+        """
+        Drop every region and sample from the memory cache and reset its counters
+        :return: None
+        """
+        with cls._lock:
+            cls._cache_mem.clear()
+            cls._cache_sample.clear()
+            cls._cache_lru.clear()
+            cls._cache_nbytes.clear()
+            cls._cache_stats.update(hits=0, misses=0, evictions=0, bytes=0)
+
+    def _sample_region(self, data, region, rate):
+        """
+        Draw a sample of the region data stratified by year
+        Each row carries the size of its stratum ("_N") and the number of rows sampled from it ("_n")
+        :param data: processed region data
+        :param region: region code
+        :param rate: fraction of rows sampled from each stratum, at least 2 and at most sample_max_stratum rows
+                     are kept per stratum
+        :return: dict({(header: str): (values: np.array)})
+        """
+        years = data["p2a"].astype("datetime64[Y]").astype(int)
+
+        # order rows randomly within each year, deterministic for a given region and rate
+        rng = np.random.default_rng([int(self.regions[region]), round(rate * 1e6)])
+        order = np.lexsort((rng.random(years.shape[0]), years))
+
+        _, starts, sizes = np.unique(years[order], return_index=True, return_counts=True)
+        wanted = np.minimum(sizes, np.maximum(2, np.minimum(np.round(rate * sizes).astype(int),
+                                                            self.sample_max_stratum)))
+        stratum = np.repeat(np.arange(sizes.shape[0]), sizes)
+        keep = np.arange(order.shape[0]) - starts[stratum] < wanted[stratum]
+
+        rows, stratum = order[keep], stratum[keep]
+        by_row = np.argsort(rows)
+        rows, stratum = rows[by_row], stratum[by_row]
+
+        sample = {colname: values[rows] for colname, values in data.items()}
+        sample["_N"] = sizes[stratum]
+        sample["_n"] = wanted[stratum]
+
+        return sample
+
+    def _save_samples(self, region, data):
+        """
+        Draw every stratified sample of the given region and save it as a gzip compressed pickle dump
+        :param region: region to sample
+        :param data: processed region data
+        :return: dict mapping every rate from sample_rates to its sample
+        """
+        samples = {rate: self._sample_region(data, region, rate) for rate in self.sample_rates}
+
+        for rate, sample in samples.items():
+            self._dump_atomic(sample, self._sample_filename.format(region, rate))
+
+        with self._lock:
+            for rate, sample in samples.items():
+                self._cache_insert((region, rate), sample)
+
+        return samples
+
+    def _load_sample(self, region, rate):
+        """
+        Load the stratified sample for the given region and rate from a gzip compressed pickle dump
+        :param region: region to load
+        :param rate: sampling rate
+        :return: the sample if the cached sample file exists, None otherwise
+        """
+        if not Path(self._sample_filename.format(region, rate)).exists():
+            return None
+
+        with gzip.open(self._sample_filename.format(region, rate), "rb") as file_gz:
+            return pickle.load(file_gz)
+
+    def _get_sample(self, region, rate):
+        """
+        Return the stratified sample of the region from memory or a cache file, draw it if neither exists
+        Concurrent callers share a single load like in _get_region
+        :param region: region code
+        :param rate: sampling rate
+        :return: dict({(header: str): (values: np.array)})
+        """
+        with self._lock:
+            sample = self._cache_hit((region, rate))
+            if sample is not None:
+                return sample
+
+        with self._region_lock(region):
+            with self._lock:
+                sample = self._cache_hit((region, rate))
+                if sample is not None:
+                    return sample
+                self._cache_stats["misses"] += 1
+
+            sample = self._load_sample(region, rate)
+            if sample is not None:
+                with self._lock:
+                    self._cache_insert((region, rate), sample)
+                return sample
+
+            # parsing a cold region in _get_region draws and caches its samples already
+            data = self._get_region(region)
+            with self._lock:
+                sample = self._cache_sample.get((region, rate))
+
+            return sample if sample is not None else self._save_samples(region, data)[rate]
+
+    def get_sample(self, regions=None, rate=None):
+        """
+        Returns the merged stratified sample (by region and year) across every region listed in regions
+        :param regions: List of regions or None, if None or len(regions) == 0 every region is assumed
+        :param rate: one of sample_rates, the lowest rate if None
+        :return: dict({(header: str): (values: np.array)}) with the additional "_N" and "_n" columns
+        """
+        if regions is None or len(regions) == 0:
+            regions = self.regions.keys()
+
+        rate = min(self.sample_rates) if rate is None else rate
+        if rate not in self.sample_rates:
+            raise ValueError(f"Unknown sampling rate {rate}, available rates are {self.sample_rates}")
+
+        dataset = {}
+        for wanted_region in regions:
+            dataset = self._merge_dicts(dataset, self._get_sample(wanted_region, rate))
+
+        return dataset
 
     def get_dict(self, regions=None):
         """
         Returns the merged dataset across every region listed in regions
         The datasets are loaded from memory or a cache file, if neither exists parse_region_data is called
+        This method is thread-safe, concurrent calls for the same region share a single load
         :param regions: List of regions or None, if None or len(regions) == 0 every region is assumed
         :return: dict({(header: str): (values: np.array)})
         """
@@ -218,11 +496,7 @@ class DataDownloader:
 
         dataset = {}
         for wanted_region in regions:
-            if wanted_region not in self._cache_mem and self._load_cache(wanted_region) is False:
-                self._cache_mem[wanted_region] = self.parse_region_data(wanted_region)
-                self._save_cache(wanted_region)
-
-            dataset = self._merge_dicts(dataset, self._cache_mem[wanted_region])
+            dataset = self._merge_dicts(dataset, self._get_region(wanted_region))
 
         return dataset
 
@@ -1,14 +1,19 @@
 #!/usr/bin/python3.8
 # coding=utf-8
+import argparse
 from pathlib import Path
 
 import pandas as pd
 import geopandas
 import matplotlib.pyplot as plt
+import matplotlib.colors
 import contextily as ctx
 import sklearn.cluster
 import numpy as np
 
+from cache import BuildCache
+from server import QueryClient
+
 
 def make_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
     """
@@ -30,13 +35,90 @@ def make_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
     return geopandas.GeoDataFrame(df, geometry=geopandas.points_from_xy(df["d"], df["e"]), crs="EPSG:5514")
 
 
+def _density_raster(x: np.ndarray, y: np.ndarray, bounds: np.ndarray, bins: int,
+                    weights: np.ndarray = None) -> np.ndarray:
+    """
+    Bin the point coordinates into a raster covering the given bounds
+    :param x: projected x coordinates
+    :param y: projected y coordinates
+    :param bounds: raster extent as (minx, miny, maxx, maxy)
+    :param bins: number of pixels along the longer side, the other side keeps the aspect ratio
+    :param weights: if given, every pixel holds the mean weight of its points instead of the point count
+    :return: masked 2D array with rows along y, empty pixels are masked
+    """
+    width, height = bounds[2] - bounds[0], bounds[3] - bounds[1]
+    scale = bins / max(width, height, np.finfo(float).eps)
+    shape = (max(1, round(height * scale)), max(1, round(width * scale)))
+    extent = [[bounds[1], bounds[3]], [bounds[0], bounds[2]]]
+
+    counts, _, _ = np.histogram2d(y, x, bins=shape, range=extent)
+    if weights is not None:
+        sums, _, _ = np.histogram2d(y, x, bins=shape, range=extent, weights=weights)
+        return np.ma.masked_where(counts == 0, sums / np.maximum(counts, 1))
+
+    return np.ma.masked_equal(counts, 0)
+
+
+def plot_density(ax: plt.Axes, gdf: geopandas.GeoDataFrame, bounds: np.ndarray = None,
+                 bins: int = 400, log: bool = True, category: str = None, colors=None,
+                 weights: np.ndarray = None, cmap: str = "viridis", vmax: float = None) -> list:
+    """
+    Draws the points as density rasters instead of individual markers
+    The rendering cost depends on the number of pixels instead of the number of points
+    :param ax: axes to draw into
+    :param gdf: the GeoDataFrame with point geometry
+    :param bounds: raster extent as (minx, miny, maxx, maxy), total bounds of gdf if None
+    :param bins: number of pixels along the longer side
+    :param log: use logarithmic color scaling
+    :param category: column name, every category is drawn as a separate layer
+    :param colors: list of colors for each layer, each layer fades from transparent to its color
+    :param weights: if given, every pixel shows the mean weight of its points instead of the point count
+    :param cmap: colormap used for layers without a color
+    :param vmax: upper limit of the color scale, pass the same value to make several plots comparable,
+                 the maximum of each layer if None
+    :return: list of the drawn images
+    """
+    bounds = gdf.total_bounds if bounds is None else bounds
+    x, y = gdf.geometry.x.values, gdf.geometry.y.values
+
+    if category is None:
+        layers = [np.ones(x.shape[0], dtype=bool)]
+    else:
+        layers = [(gdf[category] == value).values for value in pd.unique(gdf[category])]
+
+    images = []
+    for i, mask in enumerate(layers):
+        raster = _density_raster(x[mask], y[mask], bounds, bins, None if weights is None else weights[mask])
+        if raster.count() == 0:
+            continue
+
+        layer_vmax = raster.max() if vmax is None else vmax
+        if log:
+            # point counts start at 1, so the lower limit is the same for every plot
+            vmin = 1 if weights is None else max(raster.min(), np.finfo(float).tiny)
+            norm = matplotlib.colors.LogNorm(vmin=vmin, vmax=layer_vmax)
+        else:
+            norm = matplotlib.colors.Normalize(vmin=0, vmax=layer_vmax)
+
+        layer_cmap = cmap
+        if colors is not None:
+            rgb = matplotlib.colors.to_rgb(colors[i % len(colors)])
+            layer_cmap = matplotlib.colors.LinearSegmentedColormap.from_list("", [(*rgb, 0.3), (*rgb, 1.0)])
+
+        images.append(ax.imshow(raster, extent=(bounds[0], bounds[2], bounds[1], bounds[3]), origin="lower",
+                                cmap=layer_cmap, norm=norm, interpolation="nearest", zorder=2))
+
+    return images
+
+
 def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
-             show_figure: bool = False):
+             show_figure: bool = False, raster: bool = False):
     """
     Plots accident locations to 6 subplots depending on road type and year
     :param gdf: the GeoDataFrame from which to plot
     :param fig_location: file name where the figure should be saved
     :param show_figure: if True shows the figure at runtime
+    :param raster: draw the accidents as a density raster instead of individual markers
     :return: None
     """
     # Static things
@@ -45,8 +127,8 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
     chosen_region = "JHM"
     title_str = chosen_region + " kraj: {road_type} ({year})"
 
-    # Subplots
-    fig, ax = plt.subplots(3, 2, figsize=(8, 10))
+    # Subplots, the colorbars of the rasters are placed by the constrained layout
+    fig, ax = plt.subplots(3, 2, figsize=(8, 10), constrained_layout=raster)
 
     # filter region and transform to webmercator
     data = gdf[gdf["region"] == chosen_region].to_crs("EPSG:3857")
@@ -58,6 +140,13 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
     # Save the map using the whole boundary -> same map for each subplot
     bounds = data.total_bounds
 
+    # share one color scale across every raster subplot so they can be compared
+    vmax = None
+    if raster:
+        vmax = max(_density_raster(subset.geometry.x.values, subset.geometry.y.values, bounds, 400).max()
+                   for _, subset in data.groupby([data["date"].dt.year, "p36"]))
+    images = [[], []]
+
     for i, ax_year in enumerate(ax):
         target_year = 2018 + i
         bitmap_year = data["date"].dt.year == target_year
@@ -66,12 +155,21 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
             ax_roadtype.set_axis_off()
             ax_roadtype.set_xlim(xmin=bounds[0], xmax=bounds[2])
             ax_roadtype.set_ylim(ymin=bounds[1], ymax=bounds[3])
-            data[bitmap_year & (data["p36"] == u)].plot(ax=ax_roadtype, markersize=1, color=colors[u])
+            if raster:
+                images[u] += plot_density(ax_roadtype, data[bitmap_year & (data["p36"] == u)], bounds,
+                                          colors=[colors[u]], vmax=vmax)
+            else:
+                data[bitmap_year & (data["p36"] == u)].plot(ax=ax_roadtype, markersize=1, color=colors[u])
             ctx.add_basemap(ax_roadtype, crs=data.crs.to_string(), alpha=0.9, attribution_size=6,
                             reset_extent=False, source=ctx.providers.Stamen.TonerLite)
             ax_roadtype.set_title(title_str.format(road_type=roadtypes[u], year=target_year), fontsize="small")
 
-    plt.tight_layout()
+    for u, road_images in enumerate(images):
+        if road_images:
+            fig.colorbar(road_images[0], ax=ax[:, u], label="Počet nehôd", shrink=0.6)
+
+    if not raster:
+        plt.tight_layout()
 
     if fig_location:
         Path(fig_location).parent.mkdir(parents=True, exist_ok=True)
@@ -82,12 +180,13 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
 
 
 def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
-                 show_figure: bool = False):
+                 show_figure: bool = False, raster: bool = False):
     """
     Plots accident locations with clustered color depending on the frequency of accidents in that location
     :param gdf: the GeoDataFrame from which to plot
     :param fig_location: file name where the figure should be saved
     :param show_figure: if True shows the figure at runtime
+    :param raster: draw the accidents as a raster of cluster sizes instead of individual markers
     :return: None
     """
     # Static things
@@ -109,11 +208,20 @@ def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
     # and this clustering method produces similar results in each run unlike e.g. MiniBatch KMeans
     data["frequency_group"] = sklearn.cluster.AgglomerativeClustering(n_clusters=20).fit(points).labels_
 
-    # magic at this point.. for each group of points assign the cluster size
-    # this value will represent the color in the resulting map
-    data = data.dissolve(by="frequency_group", aggfunc={"p1": "count"})
+    if raster:
+        # each pixel shows the size of the cluster its accidents belong to
+        labels = data["frequency_group"].values
+        images = plot_density(ax, data, log=False, weights=np.bincount(labels)[labels].astype(float))
+        ax.set_xlim(data.total_bounds[[0, 2]])
+        ax.set_ylim(data.total_bounds[[1, 3]])
+        if images:
+            fig.colorbar(images[0], ax=ax, label="Počet nehôd v zhluku")
+    else:
+        # magic at this point.. for each group of points assign the cluster size
+        # this value will represent the color in the resulting map
+        data = data.dissolve(by="frequency_group", aggfunc={"p1": "count"})
 
-    data.plot(ax=ax, markersize=1, column="p1", legend=True)
+        data.plot(ax=ax, markersize=1, column="p1", legend=True)
     ax.set_axis_off()
     ctx.add_basemap(ax, crs=data.crs.to_string(), alpha=0.9, attribution_size=6,
                     reset_extent=False, source=ctx.providers.Stamen.TonerLite)
@@ -130,6 +238,24 @@ def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
 
 if __name__ == "__main__":
     # zde muzete delat libovolne modifikace
-    gdf_v = make_geo(pd.read_pickle("accidents.pkl.gz"))
-    plot_geo(gdf_v, "geo1.png", True)
-    plot_cluster(gdf_v, "geo2.png", True)
+    parser = argparse.ArgumentParser(description="Plot accident maps")
+    parser.add_argument('--server', default=None,
+                        help='URL of a running query server, loads the data locally if not given')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild the outputs even if they are up to date')
+    parser.add_argument('--raster', action='store_true',
+                        help='Draw the accidents as density rasters instead of individual markers')
+    args = parser.parse_args()
+
+    if args.server:
+        gdf_v = make_geo(QueryClient(args.server).select(["p1", "p2a", "p36", "region", "d", "e",
+                                                          "k", "p", "q", "t", "l", "i", "h"]))
+    else:
+        gdf_v = make_geo(pd.read_pickle("accidents.pkl.gz"))
+
+    # rebuild only the maps whose data slice or code changed
+    cache = BuildCache(force=args.force)
+    cache.build(plot_geo, gdf_v, "geo1.png",
+                columns=["d", "e", "region", "date", "p36"], show_figure=True, raster=args.raster)
+    cache.build(plot_cluster, gdf_v, "geo2.png",
+                columns=["d", "e", "region", "p1", "p36"], show_figure=True, raster=args.raster)
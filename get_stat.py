@@ -8,7 +8,9 @@ import matplotlib.colors
 import matplotlib.pyplot as plt
 import numpy as np
 
+from cache import BuildCache
 from download import DataDownloader
+from server import QueryClient
 
 causes = ["Přerušovaná žlutá", "Semafor mimo provoz", "Dopravní značky", "Přenosné dopravní značky",
           "Nevyznačena", "Žádná úprava"]
@@ -70,9 +72,21 @@ if __name__ == '__main__':
                         help='Figure save location')
     parser.add_argument('--show_figure', action='store_true',
                         help='Show figures')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild the figure even if it is up to date')
+    parser.add_argument('--server', default=None,
+                        help='URL of a running query server, loads the data locally if not given')
 
     args = parser.parse_args()
 
-    dd = DataDownloader()
-    data = dd.get_dict()
-    plot_stat(data, fig_location=args.fig_location, show_figure=args.show_figure)
+    if args.server:
+        data = {col: values.values for col, values in QueryClient(args.server).select(["p24", "region"]).items()}
+    else:
+        dd = DataDownloader()
+        data = dd.get_dict()
+
+    if args.fig_location:
+        BuildCache(force=args.force).build(plot_stat, data, args.fig_location,
+                                           columns=["p24", "region"], show_figure=args.show_figure)
+    else:
+        plot_stat(data, show_figure=args.show_figure)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import NamedTuple
+
+import numpy as np
+
+# Maximum number of array elements drawn in one batch, bounds the memory used per worker
+_max_batch_elements = 2 ** 24
+
+
+class Interval(NamedTuple):
+    value: float
+    low: float
+    high: float
+
+
+class PermutationResult(NamedTuple):
+    statistic: float
+    pvalue: float
+
+
+def _run_batches(draw, n_rep: int, cost: int, seed=None, n_jobs: int = None) -> np.ndarray:
+    """
+    Draw n_rep replicates in batches, optionally spread across processes
+    Every batch gets its own child seed, so the result does not depend on n_jobs
+    :param draw: picklable callable draw(seed_sequence, size) returning an array of size replicates
+    :param n_rep: total number of replicates
+    :param cost: number of array elements needed for a single replicate
+    :param seed: seed for np.random.SeedSequence, None for a random seed
+    :param n_jobs: number of worker processes, None uses every core, 1 runs in the current process
+    :return: array of n_rep replicates
+    """
+    batch = max(1, _max_batch_elements // max(1, cost))
+    sizes = [min(batch, n_rep - start) for start in range(0, n_rep, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if n_jobs == 1 or len(sizes) == 1:
+        parts = list(map(draw, seeds, sizes))
+    else:
+        with ProcessPoolExecutor(n_jobs or os.cpu_count()) as executor:
+            parts = list(executor.map(draw, seeds, sizes))
+
+    return np.concatenate(parts)
+
+
+def _draw_multinomial(counts, selected, within, seed, size):
+    """
+    Resample category counts and compute the selected count or its share within the given categories
+    """
+    rng = np.random.default_rng(seed)
+    n = counts.sum()
+    rep = rng.multinomial(n, counts / n, size=size)
+    num = rep[:, selected].sum(axis=1)
+
+    if within is None:
+        return num.astype(float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return num / rep[:, within].sum(axis=1)
+
+
+def _draw_mean(values, seed, size):
+    """
+    Resample the values with replacement and compute the mean of each replicate
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, values.shape[0], (size, values.shape[0]))
+    return values[idx].mean(axis=1)
+
+
+def _draw_hypergeometric(n_success, n_a, n_b, seed, size):
+    """
+    Permute group labels of binary outcomes and compute the difference in proportions
+    """
+    rng = np.random.default_rng(seed)
+    success_a = rng.hypergeometric(n_success, n_a + n_b - n_success, n_a, size=size)
+    return success_a / n_a - (n_success - success_a) / n_b
+
+
+def _draw_permuted_means(pooled, n_a, seed, size):
+    """
+    Permute the pooled values and compute the difference in group means
+    """
+    rng = np.random.default_rng(seed)
+    perm = rng.permuted(np.tile(pooled, (size, 1)), axis=1)
+    return perm[:, :n_a].mean(axis=1) - perm[:, n_a:].mean(axis=1)
+
+
+def _categories(index):
+    """
+    Normalize a category index, list or mask so that it always selects a 1D set of categories
+    """
+    return index if isinstance(index, slice) else np.atleast_1d(index)
+
+
+def _interval(value, reps, ci) -> Interval:
+    """
+    Make a percentile confidence interval from the replicates
+    """
+    low, high = np.nanquantile(reps, [(1 - ci) / 2, 1 - (1 - ci) / 2])
+    return Interval(float(value), float(low), float(high))
+
+
+def _pvalue(statistic, reps) -> PermutationResult:
+    """
+    Compute the two-sided permutation p-value of the observed statistic
+    Replicates equal to the statistic up to floating point error count as ties (as in scipy.stats.permutation_test)
+    """
+    gamma = abs(statistic) * 100 * np.finfo(np.float64).eps
+    pvalue = (1 + np.count_nonzero(np.abs(reps) >= abs(statistic) - gamma)) / (reps.shape[0] + 1)
+    return PermutationResult(float(statistic), float(pvalue))
+
+
+def bootstrap_count(counts, selected, n_boot: int = 10000, ci: float = 0.95,
+                    seed=None, n_jobs: int = None) -> Interval:
+    """
+    Bootstrap confidence interval for the number of records in the selected categories
+    :param counts: number of records in each category
+    :param selected: index, list or mask of the counted categories
+    :param n_boot: number of bootstrap replicates
+    :param ci: confidence level of the interval
+    :param seed: seed for reproducible results
+    :param n_jobs: number of worker processes, None uses every core
+    :return: Interval(value, low, high)
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    selected = _categories(selected)
+    draw = partial(_draw_multinomial, counts, selected, None)
+    reps = _run_batches(draw, n_boot, counts.shape[0], seed, n_jobs)
+    return _interval(np.sum(counts[selected]), reps, ci)
+
+
+def bootstrap_proportion(counts, selected, within=None, n_boot: int = 10000, ci: float = 0.95,
+                         seed=None, n_jobs: int = None) -> Interval:
+    """
+    Bootstrap confidence interval for the share of records in the selected categories
+    :param counts: number of records in each category
+    :param selected: index, list or mask of the categories in the numerator
+    :param within: index, list or mask of the categories in the denominator, None for every category
+    :param n_boot: number of bootstrap replicates
+    :param ci: confidence level of the interval
+    :param seed: seed for reproducible results
+    :param n_jobs: number of worker processes, None uses every core
+    :return: Interval(value, low, high) with the share in the range [0, 1]
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    selected = _categories(selected)
+    within = np.arange(counts.shape[0]) if within is None else _categories(within)
+    draw = partial(_draw_multinomial, counts, selected, within)
+    reps = _run_batches(draw, n_boot, counts.shape[0], seed, n_jobs)
+    return _interval(np.sum(counts[selected]) / np.sum(counts[within]), reps, ci)
+
+
+def bootstrap_mean(values, n_boot: int = 10000, ci: float = 0.95,
+                   seed=None, n_jobs: int = None) -> Interval:
+    """
+    Bootstrap confidence interval for the mean of the values
+    :param values: 1D array of observations
+    :param n_boot: number of bootstrap replicates
+    :param ci: confidence level of the interval
+    :param seed: seed for reproducible results
+    :param n_jobs: number of worker processes, None uses every core
+    :return: Interval(value, low, high)
+    """
+    values = np.asarray(values, dtype=float)
+    reps = _run_batches(partial(_draw_mean, values), n_boot, values.shape[0], seed, n_jobs)
+    return _interval(values.mean(), reps, ci)
+
+
+def permutation_test_proportions(success_a: int, n_a: int, success_b: int, n_b: int,
+                                 n_perm: int = 10000, seed=None, n_jobs: int = None) -> PermutationResult:
+    """
+    Two-sided permutation test of equal proportions in two groups
+    Permuting the group labels of binary outcomes is drawn directly from the hypergeometric distribution
+    :param success_a: number of successes in group A
+    :param n_a: size of group A
+    :param success_b: number of successes in group B
+    :param n_b: size of group B
+    :param n_perm: number of permutations
+    :param seed: seed for reproducible results
+    :param n_jobs: number of worker processes, None uses every core
+    :return: PermutationResult(statistic, pvalue), statistic is the difference in proportions A - B
+    """
+    draw = partial(_draw_hypergeometric, success_a + success_b, n_a, n_b)
+    reps = _run_batches(draw, n_perm, 1, seed, n_jobs)
+    return _pvalue(success_a / n_a - success_b / n_b, reps)
+
+
+def permutation_test_means(a, b, n_perm: int = 10000, seed=None, n_jobs: int = None) -> PermutationResult:
+    """
+    Two-sided permutation test of equal means in two groups
+    :param a: 1D array of observations in group A
+    :param b: 1D array of observations in group B
+    :param n_perm: number of permutations
+    :param seed: seed for reproducible results
+    :param n_jobs: number of worker processes, None uses every core
+    :return: PermutationResult(statistic, pvalue), statistic is the difference in means A - B
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    pooled = np.concatenate((a, b))
+    reps = _run_batches(partial(_draw_permuted_means, pooled, a.shape[0]), n_perm, pooled.shape[0], seed, n_jobs)
+    return _pvalue(a.mean() - b.mean(), reps)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2_contingency
+
+from download import DataDownloader
+
+# Number of flat indices counted at once, bounds the memory used by the counting pass
+_chunk_size = 2 ** 22
+
+
+def _column_values(data, col) -> np.ndarray:
+    """
+    Get the values of a column with the invalid number replacement of DataDownloader masked as missing (nan)
+    :param data: DataFrame or dict({(header: str): (values: np.array)}) as returned from DataDownloader.get_dict
+    :param col: column name
+    :return: array of the column values
+    """
+    values = np.asarray(data[col])
+    if values.dtype.kind in "iuf":
+        invalid = values == DataDownloader._invalid_num_replacement
+        if invalid.any():
+            values = np.where(invalid, np.nan, values.astype(float))
+
+    return values
+
+
+def _factorize_columns(data, columns):
+    """
+    Encode every column as integer codes in the range [0, n_levels), missing values are encoded as -1
+    :param data: DataFrame or dict({(header: str): (values: np.array)}) as returned from DataDownloader.get_dict
+    :param columns: columns to encode
+    :return: tuple of the code matrix with one row per column and the number of levels of each column
+    """
+    n_rows = len(data[columns[0]]) if columns else 0
+    codes = np.empty((len(columns), n_rows), dtype=np.int32)
+    n_levels = np.empty(len(columns), dtype=np.int64)
+
+    for i, col in enumerate(columns):
+        codes[i], uniques = pd.factorize(_column_values(data, col), sort=True)
+        n_levels[i] = len(uniques)
+
+    return codes, n_levels
+
+
+def contingency_tables(codes, n_levels, pairs, groups=None, n_groups=1):
+    """
+    Count the contingency tables of every column pair (and group) in a single vectorized pass
+    :param codes: code matrix as returned from _factorize_columns
+    :param n_levels: number of levels of each column as returned from _factorize_columns
+    :param pairs: array of shape (n_pairs, 2) with row indices into codes
+    :param groups: group code of each record or None if the records should not be split
+    :param n_groups: number of groups
+    :return: list of arrays of shape (n_groups, n_levels[a], n_levels[b]), one for every pair (a, b)
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    n_rows = codes.shape[1]
+    if groups is None:
+        groups = np.zeros(n_rows, dtype=np.int64)
+
+    na, nb = n_levels[pairs[:, 0]], n_levels[pairs[:, 1]]
+    sizes = n_groups * na * nb
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    total = offsets[-1]
+
+    # the last bin collects records with a missing value in either column
+    counts = np.zeros(total + 1, dtype=np.int64)
+    step = max(1, _chunk_size // max(1, len(pairs)))
+
+    for start in range(0, n_rows, step):
+        g = groups[start:start + step]
+        ca = codes[pairs[:, 0], start:start + step]
+        cb = codes[pairs[:, 1], start:start + step]
+
+        flat = offsets[:-1, None] + (g[None, :] * na[:, None] + ca) * nb[:, None] + cb
+        flat[(ca < 0) | (cb < 0) | (g[None, :] < 0)] = total
+        counts += np.bincount(flat.ravel(), minlength=total + 1)
+
+    return [counts[offsets[i]:offsets[i + 1]].reshape(n_groups, na[i], nb[i]) for i in range(len(pairs))]
+
+
+def _chi2_test(table):
+    """
+    Compute the chi2 test of independence for the given contingency table
+    Rows and columns without any records are dropped beforehand
+    :param table: 2D array of counts
+    :return: tuple (chi2, p, dof, n, cramers_v), the test values are nan if the table is degenerate
+    """
+    table = table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+    n = int(table.sum())
+
+    if min(table.shape) < 2:
+        return np.nan, np.nan, 0, n, np.nan
+
+    chi2, p, dof, _ = chi2_contingency(table)
+    cramers_v = np.sqrt(chi2 / (n * (min(table.shape) - 1)))
+
+    return chi2, p, dof, n, cramers_v
+
+
+def adjust_pvalues(pvalues, method: str = "fdr_bh") -> np.ndarray:
+    """
+    Correct the p-values for multiple testing, nan values are ignored and kept
+    :param pvalues: array of p-values
+    :param method: "fdr_bh" for Benjamini-Hochberg or "bonferroni"
+    :return: array of adjusted p-values
+    """
+    pvalues = np.asarray(pvalues, dtype=float)
+    adjusted = np.full(pvalues.shape, np.nan)
+    valid = ~np.isnan(pvalues)
+    p = pvalues[valid]
+    m = p.shape[0]
+
+    if method == "bonferroni":
+        adjusted[valid] = np.minimum(p * m, 1)
+    elif method == "fdr_bh":
+        order = np.argsort(p)
+        ranked = p[order] * m / np.arange(1, m + 1)
+        ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+        adjusted_valid = np.empty(m)
+        adjusted_valid[order] = np.minimum(ranked, 1)
+        adjusted[valid] = adjusted_valid
+    else:
+        raise ValueError(f"Unknown correction method {method}")
+
+    return adjusted
+
+
+def scan(data, columns=None, target=None, by: str = None, max_levels: int = 20,
+         method: str = "fdr_bh", alpha: float = 0.05, n_jobs: int = None) -> pd.DataFrame:
+    """
+    Run chi2 tests of independence over many column pairs and return them ranked
+    :param data: DataFrame or dict({(header: str): (values: np.array)}) as returned from DataDownloader.get_dict
+    :param columns: columns to test, if None every column with 2 to max_levels distinct values is used
+    :param target: column name or array tested against every column, if None every pair of columns is tested
+    :param by: column name to split the records by (e.g. "region"), every group is tested separately
+    :param max_levels: columns with more distinct values are skipped
+    :param method: multiple testing correction passed to adjust_pvalues
+    :param alpha: significance level applied to the adjusted p-values
+    :param n_jobs: number of worker processes for the tests, None uses every core
+    :return: dataframe with one row per test sorted by the adjusted p-value and the effect size
+    """
+    keys = list(data.keys())
+    if target is not None and not isinstance(target, str):
+        target_name = getattr(target, "name", None) or "target"
+        data = {**{key: data[key] for key in keys}, target_name: np.asarray(target)}
+        target = target_name
+
+    if columns is None:
+        columns = [col for col in keys if col not in (target, by)]
+
+    # skip columns which are constant or have too many levels to be categorical before encoding them
+    columns = [col for col in columns if 2 <= pd.Series(_column_values(data, col)).nunique() <= max_levels]
+    n_tested = len(columns)
+    columns = columns + ([target] if target is not None else [])
+
+    if n_tested == 0:
+        res_columns = ([by] if by is not None else []) + ["x", "y", "chi2", "p", "dof", "n", "cramers_v",
+                                                          "p_adj", "reject"]
+        return pd.DataFrame(columns=res_columns)
+
+    codes, n_levels = _factorize_columns(data, columns)
+
+    if target is not None:
+        pairs = [(i, n_tested) for i in range(n_tested)]
+    else:
+        pairs = list(itertools.combinations(range(n_tested), 2))
+
+    if by is not None:
+        groups, group_names = pd.factorize(np.asarray(data[by]), sort=True)
+    else:
+        groups, group_names = None, [None]
+
+    tables = contingency_tables(codes, n_levels, pairs, groups, len(group_names))
+    flat_tables = [table[g] for table in tables for g in range(len(group_names))]
+
+    if n_jobs == 1:
+        results = list(map(_chi2_test, flat_tables))
+    else:
+        workers = n_jobs or os.cpu_count()
+        with ProcessPoolExecutor(workers) as executor:
+            chunk = max(1, len(flat_tables) // (4 * workers))
+            results = list(executor.map(_chi2_test, flat_tables, chunksize=chunk))
+
+    res = pd.DataFrame(results, columns=["chi2", "p", "dof", "n", "cramers_v"])
+    res.insert(0, "y", [columns[b] for _, b in pairs for _ in group_names])
+    res.insert(0, "x", [columns[a] for a, _ in pairs for _ in group_names])
+    if by is not None:
+        res.insert(0, by, [name for _ in pairs for name in group_names])
+
+    res["p_adj"] = adjust_pvalues(res["p"], method)
+    res["reject"] = res["p_adj"] < alpha
+
+    return res.sort_values(by=["p_adj", "cramers_v"], ascending=[True, False]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    accidents_df = pd.read_pickle("accidents.pkl.gz")
+
+    # every coded column against fatal accidents, split by region
+    scanned_cols = [col for col in accidents_df.columns if col not in ("p13a", "region")]
+    ranked = scan(accidents_df, columns=scanned_cols, target=(accidents_df["p13a"] > 0).rename("fatal"), by="region")
+    print(ranked.head(30).to_string())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import operator
+import pickle
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import requests
+
+# Comparison operators usable in query filters
+_filter_ops = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+}
+
+_pickle_type = "application/x-python-pickle"
+
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    """
+    Get a column of the dataframe, "col.attr" names access datetime attributes (e.g. "date.year")
+    :param df: dataframe to examine
+    :param name: column name
+    :return: the column
+    """
+    if name not in df.columns and "." in name:
+        col, attr = name.split(".", 1)
+        return getattr(df[col].dt, attr).rename(name)
+
+    return df[name]
+
+
+def filter_mask(df: pd.DataFrame, filters: dict) -> np.ndarray:
+    """
+    Evaluate the query filters
+    Every filter maps a column to a value (equality), a list of values (membership)
+    or a dict of comparisons such as {"ge": 2018, "lt": 2021}, all filters must hold
+    :param df: dataframe to examine
+    :param filters: dict of filters
+    :return: boolean mask of the matching rows
+    """
+    mask = np.ones(len(df), dtype=bool)
+
+    for name, cond in (filters or {}).items():
+        col = _column(df, name)
+        if isinstance(cond, dict):
+            for op, value in cond.items():
+                mask &= _filter_ops[op](col, value).values
+        elif isinstance(cond, list):
+            mask &= col.isin(cond).values
+        else:
+            mask &= (col == cond).values
+
+    return mask
+
+
+def apply_query(df: pd.DataFrame, query: dict):
+    """
+    Evaluate a query over the dataframe
+    Supported queries:
+        {"op": "count", "filter": {...}}                        -> {"count": int}
+        {"op": "groupby", "by": [...], "filter": {...}}         -> {"groups": [{...columns, "count": int}]}
+        {"op": "select", "columns": [...], "filter": {...}}     -> pd.DataFrame
+    :param df: dataframe to examine
+    :param query: query dict
+    :return: JSON serializable result or a dataframe for the select operation
+    """
+    if not isinstance(query, dict):
+        raise ValueError("The query must be a JSON object")
+
+    op = query.get("op", "count")
+    mask = filter_mask(df, query.get("filter"))
+
+    if op == "count":
+        return {"count": int(np.count_nonzero(mask))}
+
+    data = df[mask]
+    if op == "groupby":
+        by = [_column(data, name) for name in query["by"]]
+        groups = data.groupby(by, observed=True).size().reset_index(name="count")
+        return {"groups": json.loads(groups.to_json(orient="records", date_format="iso"))}
+
+    if op == "select":
+        columns = query.get("columns")
+        return data if columns is None else data[columns]
+
+    raise ValueError(f"Unknown operation {op}")
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    """
+    Handles POST /query requests with a JSON query, see apply_query
+    """
+
+    def _send(self, code: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != "/query":
+            self._send(404, json.dumps({"error": f"Unknown path {self.path}"}).encode())
+            return
+
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            result = apply_query(self.server.df, query)
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            self._send(400, json.dumps({"error": repr(e)}).encode())
+            return
+
+        if isinstance(result, pd.DataFrame):
+            self._send(200, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), _pickle_type)
+        else:
+            self._send(200, json.dumps(result).encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    Local HTTP server keeping the prepared dataset resident in memory
+
+    Attributes:
+        df          the served dataframe
+    """
+
+    daemon_threads = True
+
+    def __init__(self, df: pd.DataFrame, host: str = "127.0.0.1", port: int = 8642):
+        """
+        Initializes the QueryServer
+        :param df: dataframe to serve
+        :param host: address to bind, only local addresses should be used as results are pickled
+        :param port: port to bind, 0 picks a free port
+        """
+        super().__init__((host, port), _QueryHandler)
+        self.df = df
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self) -> threading.Thread:
+        """
+        Serve requests in a background thread, stop with shutdown()
+        :return: the serving thread
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class QueryClient:
+    """
+    Thin client for the QueryServer
+    """
+
+    def __init__(self, url: str = "http://127.0.0.1:8642"):
+        """
+        Initializes the QueryClient
+        :param url: base URL of a running QueryServer
+        """
+        self._url = url.rstrip("/") + "/query"
+
+    def query(self, **query):
+        """
+        Send a query to the server, see apply_query
+        :param query: query fields
+        :return: the decoded result
+        """
+        resp = requests.post(self._url, json=query)
+        if resp.status_code != 200:
+            raise ValueError(f"Query failed with code {resp.status_code}: {resp.text}")
+
+        if resp.headers.get("Content-Type") == _pickle_type:
+            return pickle.loads(resp.content)
+
+        return resp.json()
+
+    def count(self, filters: dict = None) -> int:
+        """
+        Count the matching records
+        :param filters: query filters
+        :return: number of records
+        """
+        return self.query(op="count", filter=filters)["count"]
+
+    def groupby(self, by: list, filters: dict = None) -> pd.DataFrame:
+        """
+        Count the matching records in each group
+        :param by: columns to group by
+        :param filters: query filters
+        :return: dataframe with the group columns and a "count" column
+        """
+        return pd.DataFrame(self.query(op="groupby", by=by, filter=filters)["groups"])
+
+    def select(self, columns: list = None, filters: dict = None) -> pd.DataFrame:
+        """
+        Fetch the matching records
+        :param columns: columns to fetch, None for every column
+        :param filters: query filters
+        :return: dataframe with the matching records
+        """
+        return self.query(op="select", columns=columns, filter=filters)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the accident dataset from memory")
+    parser.add_argument('--pickle', default="accidents.pkl.gz",
+                        help='Dataframe pickle, prepared by analysis.get_dataframe the same way as in the scripts')
+    parser.add_argument('--host', default="127.0.0.1",
+                        help='Address to bind')
+    parser.add_argument('--port', type=int, default=8642,
+                        help='Port to bind')
+
+    args = parser.parse_args()
+
+    # imported here as analysis imports the client from this module
+    from analysis import get_dataframe
+    dataset = get_dataframe(args.pickle)
+
+    server = QueryServer(dataset, args.host, args.port)
+    print(f"Serving {len(dataset)} records on {server.url}")
+    server.serve_forever()
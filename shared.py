@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import uuid
+from multiprocessing import Pool, parent_process, resource_tracker, shared_memory
+
+import numpy as np
+
+from download import DataDownloader
+
+
+def _shares_tracker(owner_pid: int) -> bool:
+    """
+    Check whether this process uses the resource tracker of the publisher,
+    multiprocessing children (fork, spawn and forkserver) inherit the tracker of their parent
+    :param owner_pid: process id of the publisher
+    :return: True for the publisher itself and its direct multiprocessing children
+    """
+    parent = parent_process()
+    return owner_pid == os.getpid() or (parent is not None and parent.pid == owner_pid)
+
+
+def _open_segment(name: str, owner_pid: int = None) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing shared memory segment without handing it over to the resource tracker,
+    so that a consumer exiting does not unlink the segment of the publisher
+    :param name: segment name
+    :param owner_pid: process id of the publisher, None if unknown
+    :return: the attached segment
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # track is available since Python 3.13, older versions always register the segment
+        segment = shared_memory.SharedMemory(name=name)
+
+        # the registration is a set, a consumer sharing the tracker of the publisher must keep it,
+        # otherwise it removes the registration of the publisher as well
+        if owner_pid is None or not _shares_tracker(owner_pid):
+            resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class SharedDataset:
+    """
+    Column arrays stored in named shared memory segments, one segment per column
+
+    The publisher creates the segments with publish and passes the descriptor to other processes,
+    which map the same memory with attach as read-only arrays without copying or unpickling.
+    Only the publisher unlinks the segments, use the instances as context managers or call close.
+
+    Attributes:
+        descriptor  dict({(header: str): {"name": str, "dtype": str, "shape": tuple, "owner": int}}),
+                    picklable and JSON serializable, owner is the process id of the publisher
+        arrays      dict({(header: str): (values: np.array)}) backed by the shared memory
+    """
+
+    def __init__(self, descriptor: dict, segments: dict, owner: bool):
+        """
+        Initializes the SharedDataset, use publish or attach instead
+        :param descriptor: segment description of every column
+        :param segments: dict mapping columns to their SharedMemory segments
+        :param owner: True if this instance created the segments and unlinks them on close
+        """
+        self.descriptor = descriptor
+        self._segments = segments
+        self._owner = owner
+        self.arrays = {col: np.ndarray(desc["shape"], dtype=np.dtype(desc["dtype"]), buffer=segments[col].buf)
+                       for col, desc in descriptor.items()}
+
+        if not owner:
+            for values in self.arrays.values():
+                values.flags.writeable = False
+
+    @classmethod
+    def publish(cls, data: dict, prefix: str = "izv"):
+        """
+        Copy the column arrays into new shared memory segments
+        :param data: dict({(header: str): (values: np.array)}) as returned from DataDownloader.get_dict
+        :param prefix: prefix of the segment names
+        :return: the owning SharedDataset
+        """
+        token = uuid.uuid4().hex[:12]
+        owner_pid = os.getpid()
+        descriptor, segments = {}, {}
+
+        try:
+            for i, (col, values) in enumerate(data.items()):
+                values = np.ascontiguousarray(values)
+                if values.dtype.hasobject:
+                    raise ValueError(f"Column {col} with object dtype can not be shared")
+
+                segments[col] = shared_memory.SharedMemory(name=f"{prefix}_{token}_{i}", create=True,
+                                                           size=max(values.nbytes, 1))
+                np.ndarray(values.shape, dtype=values.dtype, buffer=segments[col].buf)[...] = values
+                descriptor[col] = {"name": segments[col].name, "dtype": values.dtype.str, "shape": values.shape,
+                                   "owner": owner_pid}
+        except BaseException:
+            for segment in segments.values():
+                segment.close()
+                segment.unlink()
+            raise
+
+        return cls(descriptor, segments, owner=True)
+
+    @classmethod
+    def attach(cls, descriptor: dict):
+        """
+        Map the segments of a published dataset as read-only arrays
+        :param descriptor: descriptor of the published SharedDataset
+        :return: the attached SharedDataset
+        """
+        segments = {}
+        try:
+            for col, desc in descriptor.items():
+                segments[col] = _open_segment(desc["name"], desc.get("owner"))
+        except BaseException:
+            for segment in segments.values():
+                segment.close()
+            raise
+
+        return cls(descriptor, segments, owner=False)
+
+    def close(self):
+        """
+        Release the arrays and the segments, the publisher also unlinks them
+        Arrays obtained from this instance must not be used afterwards, if they are still referenced
+        closing raises BufferError, but the publisher's segments are unlinked beforehand and do not leak
+        :return: None
+        """
+        self.arrays = {}
+        segments, self._segments = self._segments, {}
+
+        try:
+            if self._owner:
+                for segment in segments.values():
+                    segment.unlink()
+        finally:
+            for segment in segments.values():
+                segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# Dataset attached by the pool initializer in every worker process
+_worker_dataset = None
+
+
+def _attach_worker(descriptor: dict):
+    """
+    Pool initializer attaching the shared dataset in a worker process
+    :param descriptor: descriptor of the published SharedDataset
+    :return: None
+    """
+    global _worker_dataset
+    _worker_dataset = SharedDataset.attach(descriptor)
+
+
+def _count_region(region: str) -> int:
+    return int(np.count_nonzero(_worker_dataset.arrays["region"] == region))
+
+
+if __name__ == '__main__':
+    dd = DataDownloader()
+
+    with SharedDataset.publish(dd.get_dict()) as shared:
+        with Pool(initializer=_attach_worker, initargs=(shared.descriptor,)) as pool:
+            counts = pool.map(_count_region, dd.regions.keys())
+
+    for reg, count in zip(dd.regions.keys(), counts):
+        print(f"{reg}: {count}")